@@ -14,11 +14,16 @@ import matplotlib.gridspec as gsp
 from scipy.constants import hbar, e, m_e, angstrom, epsilon_0, speed_of_light, elementary_charge
 from scipy.constants import Boltzmann as kB
 from scipy.constants import c as sol
+from scipy.linalg.lapack import cheevr, zheevr
 
 import copy as cp
+import functools
+import math
 import os 
+import threading
+from typing import NamedTuple
 
-from numba import njit
+from numba import njit, prange
 import time as tm
 from scipy.integrate import odeint
 
@@ -34,86 +39,220 @@ pico = 10 ** (-12)
 life_time = 5.5 * nano
 n_refraction = 2.4
 
+# working precision of the Hamiltonians and eigensolvers, see set_precision
+_DTYPE_C = np.complex128
+_DTYPE_R = np.float64
+
+def set_precision(precision):
+    """
+        'double' (default) or 'single'. Single precision (complex64/float32) applies to system,
+        system_small, system_batch and the sweeps built on them; energy_map always works in double.
+        It only keeps ~7 significant digits -- the excited state levels sit on top of the ZPL
+        (~3e3 THz rad), so splittings below ~1e-3 THz rad are not resolved there.
+    """
+    global _DTYPE_C, _DTYPE_R
+    _dtypes = {'single': (np.complex64, np.float32), 'double': (np.complex128, np.float64)}
+    if precision not in _dtypes:
+        raise ValueError("precision must be 'single' or 'double', got %r" % (precision,))
+    _DTYPE_C, _DTYPE_R = _dtypes[precision]
+    system.cache_clear()
+
 # helper functions
-def get_eigs(matrix):
-    _w, _v = np.linalg.eigh(matrix)
-    _i = np.argsort(np.real(_w))
-    return _w[_i], _v[:, _i]
+@njit(cache=True)
+def _fix_phase(v):
+    """
+        in place phase convention for the eigenvector columns of v: the first component that is
+        (within rounding) largest in magnitude is made real and positive. Makes the result
+        independent of the LAPACK driver for non-degenerate levels.
+    """
+    for _j in range(v.shape[1]):
+        _amax = 0.
+        for _i in range(v.shape[0]):
+            _amax = max(_amax, abs(v[_i, _j]))
+        _c = v[0, _j]
+        for _i in range(v.shape[0]):
+            if abs(v[_i, _j]) >= _amax * (1. - 1e-6):
+                _c = v[_i, _j]
+                break
+        _ph = np.conj(_c) / abs(_c)
+        for _i in range(v.shape[0]):
+            v[_i, _j] *= _ph
+    return v
+
+@njit(cache=True)
+def _fix_phase_batch(vs):
+    """_fix_phase over a (N, n, n) stack"""
+    for _n in range(vs.shape[0]):
+        _fix_phase(vs[_n])
+    return vs
+
+def get_eigs(matrix, overwrite=False):
+    """
+        direct LAPACK ?heevr call -- eigenvalues come back in ascending order, no argsort needed.
+        With overwrite=True a Fortran-ordered matrix is used as LAPACK workspace without a copy.
+        Eigenvector phases follow _fix_phase.
+    """
+    matrix = np.asarray(matrix)
+    _heevr = cheevr if matrix.dtype == np.complex64 else zheevr
+    _w, _v, _m, _isuppz, _info = _heevr(matrix, compute_v=1, range='A', lower=1, overwrite_a=int(overwrite))
+    if _info != 0:
+        raise np.linalg.LinAlgError('?heevr failed with info = %d' % _info)
+    return _w, _fix_phase(_v)
+
+@njit(cache=True)
+def _eigh2(H):
+    """closed-form eigenpairs of a 2x2 hermitian matrix [[a, b], [b*, d]], ascending"""
+    _a, _d, _b = H[0, 0].real, H[1, 1].real, H[0, 1]
+    _tr = _a + _d
+    _disc = math.hypot(_a - _d, 2. * abs(_b))
+    _w = np.empty(2)
+    _w[0], _w[1] = (_tr - _disc) / 2., (_tr + _disc) / 2.
+    _v = np.zeros((2, 2), dtype=np.complex128)
+    for _k in range(2):
+        _l = _w[_k]
+        # both vectors solve (H - l) v = 0, take the better conditioned one
+        _n0 = abs(_b) ** 2 + (_l - _a) ** 2
+        _n1 = (_l - _d) ** 2 + abs(_b) ** 2
+        if _n0 == 0. and _n1 == 0.:
+            # diagonal and degenerate
+            _v[_k, _k] = 1.
+        elif _n0 >= _n1:
+            _v[0, _k], _v[1, _k] = _b / math.sqrt(_n0), (_l - _a) / math.sqrt(_n0)
+        else:
+            _v[0, _k], _v[1, _k] = (_l - _d) / math.sqrt(_n1), np.conj(_b) / math.sqrt(_n1)
+    return _w, _v
+
+@njit(cache=True)
+def _eigh_blocks(matrix):
+    _w = np.empty(4)
+    _v = np.zeros((4, 4), dtype=np.complex128)
+    if np.any(matrix[0::2, 1::2] != 0):
+        return _w, _v, False
+    for _c in range(2):
+        _wb, _vb = _eigh2(matrix[_c::2, _c::2])
+        _w[2 * _c:2 * _c + 2] = _wb
+        _v[_c::2, 2 * _c:2 * _c + 2] = _vb
+    _i = np.argsort(_w)
+    return _w[_i], _fix_phase(_v[:, _i]), True
+
+@njit(cache=True)
+def _eigvals4(H):
+    """ascending eigenvalues of a 4x4 hermitian matrix -- closed form if the spin blocks decouple"""
+    _w, _v, _decoupled = _eigh_blocks(H)
+    if _decoupled:
+        return _w
+    return np.linalg.eigvalsh(H)
+
+def get_eigs_blocks(matrix):
+    """
+        4x4 hermitian matrix without transverse spin coupling (B along the symmetry axis):
+        the {0, 2} and {1, 3} blocks decouple and are solved in closed form.
+        Falls back to get_eigs if the blocks are coupled or the matrix is not 4x4.
+        Returns the precision of the input.
+    """
+    matrix = np.asarray(matrix)
+    # the kernel indexes a fixed 4x4 layout and numba does not bounds-check
+    if matrix.shape != (4, 4):
+        return get_eigs(matrix)
+    _w, _v, _decoupled = _eigh_blocks(matrix)
+    if not _decoupled:
+        return get_eigs(matrix)
+    _dtype = np.result_type(matrix.dtype, np.complex64)
+    return _w.astype(np.finfo(_dtype).dtype, copy=False), _v.astype(_dtype, copy=False)
 
 def make_B_vector(magnitude, coordinate_vector):
     """
         Note that the coordinate vector is defined in terms of the symmetry axes of the defect *NOT* the host crystal lattice-vectors.
+        The coordinate vector only sets the direction, it is normalised to unit length.
     """
-    vec = np.array(coordinate_vector)
-    nrm = np.sum(np.abs(vec) ** 2.)
-    return magnitude * vec / nrm
+    _x, _y, _z = coordinate_vector
+    _nrm = math.sqrt(abs(_x) ** 2 + abs(_y) ** 2 + abs(_z) ** 2)
+    if _nrm == 0:
+        raise ValueError('coordinate_vector must be non-zero')
+    _f = magnitude / _nrm
+    return np.array((_f * _x, _f * _y, _f * _z))
+
+def make_B_vector_batch(magnitudes, coordinate_vectors):
+    """
+        make_B_vector over an array of N magnitudes; coordinate_vectors is a single (3,) direction
+        or one direction per magnitude, (N, 3). Returns (N, 3).
+    """
+    _m = np.asarray(magnitudes, dtype=_DTYPE_R)
+    _v = np.asarray(coordinate_vectors)
+    _nrm = np.sqrt(_v[..., 0] * _v[..., 0] + _v[..., 1] * _v[..., 1] + _v[..., 2] * _v[..., 2])
+    if np.any(_nrm == 0):
+        raise ValueError('coordinate_vectors must be non-zero')
+    return (_m / _nrm)[:, None] * _v if _v.ndim == 2 else (_m / _nrm)[:, None] * _v[None, :]
+
+# lattice basis of the defect frame, rows
+#   e_x = _C1 * [1, -2, 1],  e_y = _C2 * [1, 0, -1],  e_z = _C3 * [1, 1, 1]
+# written out below instead of a 3x3 np.dot
+_C1 = 1. / np.sqrt(6)
+_C2 = 1. / np.sqrt(2)
+_C3 = 1. / np.sqrt(3)
 
 def coord_to_lattice(coord_vector):
-    _vc = np.array(coord_vector)
-    _ex = (1. / np.sqrt(6)) * np.array([1, -2, 1])
-    _ey = (1. / np.sqrt(2)) * np.array([1, 0, -1])
-    _ez = (1. / np.sqrt(3)) * np.array([1, 1, 1])
-    _lattice_basis = np.array([_ex, _ey, _ez])
-    return np.dot(_lattice_basis.transpose(), _vc)
+    _x, _y, _z = np.asarray(coord_vector)
+    return np.array([_C1 * _x + _C2 * _y + _C3 * _z,
+                     -2. * _C1 * _x + _C3 * _z,
+                     _C1 * _x - _C2 * _y + _C3 * _z])
 
 def lattice_to_coord(lattice_vector):
-    _vc = np.array(lattice_vector).transpose()
-    _ex = (1. / np.sqrt(6)) * np.array([1, -2, 1])
-    _ey = (1. / np.sqrt(2)) * np.array([1, 0, -1])
-    _ez = (1. / np.sqrt(3)) * np.array([1, 1, 1])
-    _lattice_basis = np.array([_ex, _ey, _ez])  
-    return np.dot(_lattice_basis, _vc)
+    _x, _y, _z = np.asarray(lattice_vector).transpose()
+    return np.array([_C1 * (_x - 2. * _y + _z),
+                     _C2 * (_x - _z),
+                     _C3 * (_x + _y + _z)])
 
 # definition functions for model
-def H_SO(lambda_SO):
+def H_SO(lambda_SO, dtype=None):
     """accepts SO term depending on ground/excited state"""
     _a = 1.j * lambda_SO / 2.
     return np.array([[0, 0, -_a, 0],
                      [0, 0, 0, +_a],
                      [+_a, 0, 0, 0],
-                     [0, -_a, 0, 0]])
+                     [0, -_a, 0, 0]], dtype=dtype or _DTYPE_C)
 
 
-def H_JT(xi_xy):
+def H_JT(xi_xy, dtype=None):
     """ accepts 2-vector xi=[xi_x, xi_y]"""
     _x, _y = xi_xy
     return np.array([[+_x, 0, +_y, 0],
                      [0, +_x, 0, +_y],
                      [+_y, 0, -_x, 0],
-                     [0, +_y, 0, -_x]])
+                     [0, +_y, 0, -_x]], dtype=dtype or _DTYPE_C)
 
 
-def H_ZL(B_vec, gammaL, f):
+def H_ZL(B_vec, gammaL, f, dtype=None):
     """
         accepts
             f -
             B - vector for B field B=[Bx, By, Bz]
             gammaL -
     """
-    iBx, iBy, iBz = 1.j * B_vec
-    return f * gammaL * np.array([[0, 0, +iBz, 0],
-                                  [0, 0, 0, +iBz],
-                                  [-iBz, 0, 0, 0],
-                                  [0, -iBz, 0, 0]])
+    iBx, iBy, iBz = 1.j * f * gammaL * np.asarray(B_vec)
+    return np.array([[0, 0, +iBz, 0],
+                     [0, 0, 0, +iBz],
+                     [-iBz, 0, 0, 0],
+                     [0, -iBz, 0, 0]], dtype=dtype or _DTYPE_C)
 
 
-def H_ZS(B_vec, gammaS):
+def H_ZS(B_vec, gammaS, dtype=None):
     """
         accepts
             f -
             B - vector for B field B=[Bx, By, Bz]
             gammaL -
     """
-    _Bx, _By, _Bz = B_vec
+    _Bx, _By, _Bz = gammaS * np.asarray(B_vec)
     _Bp = _Bx + 1.j * _By
     _Bm = _Bx - 1.j * _By
-    return gammaS * np.array([[+_Bz, +_Bm, 0, 0],
-                              [+_Bp, -_Bz, 0, 0],
-                              [0, 0, +_Bz, +_Bm],
-                              [0, 0, +_Bp, -_Bz]])
+    return np.array([[+_Bz, +_Bm, 0, 0],
+                     [+_Bp, -_Bz, 0, 0],
+                     [0, 0, +_Bz, +_Bm],
+                     [0, 0, +_Bp, -_Bz]], dtype=dtype or _DTYPE_C)
 
 
-def H_st(alpha, beta, delta):
+def H_st(alpha, beta, delta, dtype=None):
     """
         accepts scaling factors for SnV strain response
             alpha - E_gx
@@ -126,41 +265,173 @@ def H_st(alpha, beta, delta):
     return np.array([[_ad0, 0, _bt, 0],
                      [0, _ad0, 0, _bt],
                      [_bt, 0, _ad1, 0],
-                     [0, _bt, 0, _ad1]])
-
-def dipole_matel():
-    _px = np.array([[+1, 0, 0, 0, ],
-                    [0, +1, 0, 0, ],
-                    [0, 0, -1, 0, ],
-                    [0, 0, 0, -1, ],] , dtype='complex')
-    _py = np.array([[0, 0, -1, 0, ],
-                    [0, 0, 0, -1, ],
-                    [-1, 0, 0, 0, ],
-                    [0, -1, 0, 0, ], ], dtype='complex')
-    _pz = np.array([[+1, 0, 0, 0, ],
-                    [0, +1, 0, 0, ],
-                    [0, 0, +1, 0, ],
-                    [0, 0, 0, +1, ], ], dtype='complex') * 2
-    return {_k: np.array(_v) for _k, _v in zip(('x', 'y', 'z'), (_px, _py, _pz))}
-
-def manifold(HT, D):
-    _Wu, _Vu = get_eigs(HT['u'])
-    _Wg, _Vg = get_eigs(HT['g'])
-
-    _Mvu, _Mvg = (np.array(_m) for _m in (_Vu, _Vg))
-
-    _p = {_axis: np.dot(_Mvg.conjugate().transpose(), np.dot(D[_axis], _Mvu)) for _axis in ('x', 'y', 'z')}
-    
-    return {'eigs': {'g': _Wg, 'u': _Wu}, 'vecs': {'g': _Mvg, 'u': _Mvu}, 'dips': _p}
+                     [0, _bt, 0, _ad1]], dtype=dtype or _DTYPE_C)
+
+# in-place versions of the field dependent terms -- accumulate into a preallocated 4x4 buffer
+@njit(cache=True)
+def _h_zl_jit(B_vec, zl_coeff, out):
+    """H_ZL with the constant f * gammaL folded into zl_coeff"""
+    _iBz = 1.j * zl_coeff * B_vec[2]
+    out[0, 2] += _iBz
+    out[1, 3] += _iBz
+    out[2, 0] -= _iBz
+    out[3, 1] -= _iBz
+
+@njit(cache=True)
+def _h_zs_jit(B_vec, gammaS, out):
+    _Bz = gammaS * B_vec[2]
+    _Bp = gammaS * (B_vec[0] + 1.j * B_vec[1])
+    _Bm = gammaS * (B_vec[0] - 1.j * B_vec[1])
+    for _i in (0, 2):
+        out[_i, _i] += _Bz
+        out[_i, _i + 1] += _Bm
+        out[_i + 1, _i] += _Bp
+        out[_i + 1, _i + 1] -= _Bz
+
+@njit(cache=True)
+def _build_h_jit(H_static, B_vec, zl_coeff, gammaS, out):
+    """writes H_static + H_ZL + H_ZS into out without temporaries"""
+    out[:, :] = H_static
+    _h_zl_jit(B_vec, zl_coeff, out)
+    _h_zs_jit(B_vec, gammaS, out)
+    return out
+
+@njit(cache=True)
+def _h_st_jit(alpha, beta, delta, out):
+    """H_st accumulated in place"""
+    for _i in (0, 1):
+        out[_i, _i] += alpha - delta
+        out[_i + 2, _i + 2] += -alpha - delta
+        out[_i, _i + 2] += beta
+        out[_i + 2, _i] += beta
+
+@njit(cache=True)
+def _build_h_strain_jit(H_static, alpha, beta, delta, B_vec, zl_coeff, gammaS, out):
+    """_build_h_jit specialised for the strained system, H_st is added in place from its parameters"""
+    _build_h_jit(H_static, B_vec, zl_coeff, gammaS, out)
+    _h_st_jit(alpha, beta, delta, out)
+    return out
+
+@njit(cache=True)
+def _build_h_batch_jit(H_static, B_vecs, zl_coeff, gammaS, out):
+    """_build_h_jit over a (N, 3) stack of field vectors into a (N, 4, 4) buffer"""
+    for _n in range(B_vecs.shape[0]):
+        _build_h_jit(H_static, B_vecs[_n], zl_coeff, gammaS, out[_n])
+    return out
+
+@njit(cache=True, parallel=True)
+def _energy_map_jit(bs, cos_phis, sin_phis, gammaS, zpl, Hg_static, zl_g, Hu_static, zl_u, out):
+    """levels on a (magnitude, angle) grid for B = b * [cos(phi), 0, sin(phi)], rows of bs in parallel"""
+    for _i in prange(bs.shape[0]):
+        # per-thread scratch
+        _B = np.zeros(3)
+        _Hg = np.empty((4, 4), dtype=np.complex128)
+        _Hu = np.empty((4, 4), dtype=np.complex128)
+        for _j in range(cos_phis.shape[0]):
+            _B[0] = bs[_i] * cos_phis[_j]
+            _B[2] = bs[_i] * sin_phis[_j]
+            _build_h_jit(Hg_static, _B, zl_g, gammaS, _Hg)
+            _build_h_jit(Hu_static, _B, zl_u, gammaS, _Hu)
+            for _k in range(4):
+                _Hu[_k, _k] += zpl
+            out[_i, _j, 0:4] = _eigvals4(_Hg)
+            out[_i, _j, 4:8] = _eigvals4(_Hu)
+    return out
+
+# dipole matrix elements -- field independent, built once
+_PX = np.array([[+1, 0, 0, 0, ],
+                [0, +1, 0, 0, ],
+                [0, 0, -1, 0, ],
+                [0, 0, 0, -1, ],] , dtype='complex')
+_PY = np.array([[0, 0, -1, 0, ],
+                [0, 0, 0, -1, ],
+                [-1, 0, 0, 0, ],
+                [0, -1, 0, 0, ], ], dtype='complex')
+_PZ = np.array([[+1, 0, 0, 0, ],
+                [0, +1, 0, 0, ],
+                [0, 0, +1, 0, ],
+                [0, 0, 0, +1, ], ], dtype='complex') * 2
+_DIPOLE = {'x': _PX, 'y': _PY, 'z': _PZ}
+_DIP_STACK = np.stack([_PX, _PY, _PZ], axis=0)
+
+def dipole_matel(dtype=None):
+    """returns the cached dipole matrices -- treat as read-only"""
+    dtype = dtype or _DTYPE_C
+    if dtype == _DIP_STACK.dtype:
+        return _DIPOLE
+    return {_k: _v.astype(dtype) for _k, _v in _DIPOLE.items()}
+
+def _dipole_stack(D):
+    if D is _DIPOLE:
+        return _DIP_STACK
+    return np.stack([D['x'], D['y'], D['z']], axis=0)
+
+class Manifold(NamedTuple):
+    """eigenvalues, eigenvectors and projected dipole operators of the ground (g) / excited (u) manifolds"""
+    eigs_g: np.ndarray
+    eigs_u: np.ndarray
+    vecs_g: np.ndarray
+    vecs_u: np.ndarray
+    dips_x: np.ndarray
+    dips_y: np.ndarray
+    dips_z: np.ndarray
+
+    def __getitem__(self, key):
+        # backwards compatible dict-style access, e.g. m['eigs']['g']
+        if isinstance(key, str):
+            return {'eigs': {'g': self.eigs_g, 'u': self.eigs_u},
+                    'vecs': {'g': self.vecs_g, 'u': self.vecs_u},
+                    'dips': {'x': self.dips_x, 'y': self.dips_y, 'z': self.dips_z}}[key]
+        return tuple.__getitem__(self, key)
+
+class System(NamedTuple):
+    """a Manifold and the full dipole operators, P is the contiguous (3, n, n) x/y/z stack"""
+    sys: Manifold
+    P: np.ndarray
+
+    @property
+    def px(self):
+        return self.P[0]
+
+    @property
+    def py(self):
+        return self.P[1]
+
+    @property
+    def pz(self):
+        return self.P[2]
+
+    def __getitem__(self, key):
+        # backwards compatible dict-style access, e.g. s['px']
+        if isinstance(key, str):
+            return self.P if key == 'p' else getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+def _embed_dipoles(dips):
+    """(..., 3, n, n) manifold dipole projections -> (..., 3, 2n, 2n) operators on the full level space"""
+    _n = dips.shape[-1]
+    P = np.zeros(dips.shape[:-2] + (2 * _n, 2 * _n), dtype=_DTYPE_C)
+    P[..., 0:_n, _n:2 * _n] = dips
+    P[..., _n:2 * _n, 0:_n] = np.swapaxes(dips, -1, -2).conjugate()
+    return P
+
+def manifold(HT, D, overwrite=False):
+    # eigenvector matrices are used as returned by the solver, no defensive copies
+    _Wu, _Mvu = get_eigs(HT['u'], overwrite)
+    _Wg, _Mvg = get_eigs(HT['g'], overwrite)
+
+    # all three axes in one stacked (3, 4, 4) contraction
+    _ps = _Mvg.conjugate().transpose() @ _dipole_stack(D) @ _Mvu
+
+    return Manifold(_Wg, _Wu, _Mvg, _Mvu, _ps[0], _ps[1], _ps[2])
 
 def manifold_small(HT, D):
-    _Wu, _Vu = get_eigs(HT['u'])
-    _Wg, _Vg = get_eigs(HT['g'])
-
-    _Mvu, _Mvg = (np.array(_m) for _m in (_Vu, _Vg))
+    # eigenvector matrices are used as returned by the solver, no defensive copies
+    _Wu, _Mvu = get_eigs_blocks(HT['u'])
+    _Wg, _Mvg = get_eigs_blocks(HT['g'])
 
-    _p = {_axis: np.dot(_Mvg.conjugate().transpose(), np.dot(D[_axis], _Mvu))[::2,::2] for _axis in ('x', 'y', 'z')}
-    return {'eigs': {'g': _Wg[::2], 'u': _Wu[::2]}, 'vecs': {'g': _Mvg[::2], 'u': _Mvu[::2]}, 'dips': _p}
+    _ps = (_Mvg.conjugate().transpose() @ _dipole_stack(D) @ _Mvu)[:, ::2, ::2]
+    return Manifold(_Wg[::2], _Wu[::2], _Mvg[::2], _Mvu[::2], _ps[0], _ps[1], _ps[2])
 
 
 # SAMPLE PARAMETERS -- from [TrushM20], ...units THz * rad
@@ -197,85 +468,171 @@ ZPL = 2 * pi * 484.32
 # Ground state hamiltonian
 
 _Hg0 = H_SO(lambda_g) + H_JT([xi_xg, xi_yg])
-_HgL = lambda _B, _s: (_Hg0
-                       + H_ZL(_B, gamma_L, f_g)
-                       + H_ZS(_B, gamma_S)
-                       + (H_st(alpha_g, beta_g, delta_g) if _s else 0)
-                       )
+
+@functools.lru_cache(maxsize=16)
+def _strained(manifold, alpha, beta, delta):
+    """field independent part including strain for the batched builders, rebuilt only when the strain parameters change"""
+    return (_Hg0 if manifold == 'g' else _Hu0) + H_st(alpha, beta, delta, dtype=np.complex128)
+
+def _Hg_static(_s):
+    return _strained('g', alpha_g, beta_g, delta_g) if _s else _Hg0
+
+def _HgL(_B, _s, out=None):
+    if out is None:
+        out = np.empty((4, 4), dtype=_DTYPE_C)
+    # the strain flag picks the specialisation, all parameters are passed at call time
+    if _s:
+        return _build_h_strain_jit(_Hg0.astype(_DTYPE_C, copy=False), alpha_g, beta_g, delta_g, np.asarray(_B),
+                                   gamma_L * f_g, gamma_S, out)
+    return _build_h_jit(_Hg0.astype(_DTYPE_C, copy=False), np.asarray(_B), gamma_L * f_g, gamma_S, out)
 
 # Excited state hamiltonian
 
 _Hu0 = H_SO(lambda_u) + H_JT([xi_xu, xi_yu])
-_HuL = lambda _B, _s: (_Hu0
-                       + H_ZL(_B, gamma_L, f_u)
-                       + H_ZS(_B, gamma_S)
-                       + (H_st(alpha_u, beta_u, delta_u) if _s else 0)
-                       )
+
+def _Hu_static(_s):
+    return _strained('u', alpha_u, beta_u, delta_u) if _s else _Hu0
+
+def _HuL(_B, _s, out=None):
+    if out is None:
+        out = np.empty((4, 4), dtype=_DTYPE_C)
+    if _s:
+        return _build_h_strain_jit(_Hu0.astype(_DTYPE_C, copy=False), alpha_u, beta_u, delta_u, np.asarray(_B),
+                                   gamma_L * f_u, gamma_S, out)
+    return _build_h_jit(_Hu0.astype(_DTYPE_C, copy=False), np.asarray(_B), gamma_L * f_u, gamma_S, out)
 
 s = False
 e_vu = []
 e_vg = []
 
+# per-thread Fortran-ordered 4x4 scratch for the Hamiltonians handed to LAPACK
+_scratch = threading.local()
+
+def _scratch_buffers(dtype):
+    _buffers = _scratch.__dict__.setdefault('buffers', {})
+    if dtype not in _buffers:
+        _buffers[dtype] = (np.empty((4, 4), dtype=dtype, order='F'), np.empty((4, 4), dtype=dtype, order='F'))
+    return _buffers[dtype]
+
 def snv_hamiltonian(_b, _s, **kwargs):
     b_vec = kwargs.get('b_vec', [0,0,1])
-    _H0 = np.zeros((8, 8), dtype=complex)
+    _H0 = np.zeros((8, 8), dtype=_DTYPE_C)
     B = make_B_vector(_b, lattice_to_coord(b_vec))
-    _HgT = np.array(_HgL(B, s))
-    _HuT = np.diag([ZPL for i in range(4)]) + np.array(_HuL(B, s))
-    _H0[0:4, 0:4] = _HuT
-    _H0[4:8, 4:8] = _HgT
+    # assemble both manifolds directly into their diagonal blocks
+    _HgL(B, s, out=_H0[4:8, 4:8])
+    _HuL(B, s, out=_H0[0:4, 0:4])
+    _H0[0:4, 0:4].flat[::5] += ZPL
     return _H0
 
 def system(_b, _s, **kwargs):
+    """
+        memoized on (_b, direction of b_vec, s), so repeated calls at the same operating point share one
+        eigensolve. The returned arrays are read-only. The Zeeman (gamma_L, gamma_S, f_g, f_u) and
+        strain parameters are read on every evaluation -- call system.cache_clear() after changing
+        them. The spin-orbit and Jahn-Teller terms (_Hg0, _Hu0) are fixed at import.
+        As before, the strain flag is the module-level s; _s is not used.
+    """
+    b_vec = np.asarray(kwargs.get('b_vec', [0,0,1]), dtype=float)
+    # only the direction matters -- normalise before rounding so short vectors key correctly
+    _nrm = math.hypot(*b_vec)
+    if _nrm:
+        b_vec = b_vec / _nrm
+    return _system_cached(float(_b), s, tuple(np.round(b_vec, 12).tolist()))
 
-    b_vec = kwargs.get('b_vec', [0,0,1])
-    P = dipole_matel()
+@functools.lru_cache(maxsize=1024)
+def _system_cached(_b, _strain, b_vec):
 
-    Px = np.zeros((8, 8), dtype=complex)
-    Py = np.zeros((8, 8), dtype=complex)
-    Pz = np.zeros((8, 8), dtype=complex)
+    D = dipole_matel(_DTYPE_C)
     B = make_B_vector(_b, b_vec)
 
-    _HgT = np.array(_HgL(B, s))
-    _HuT = np.diag([ZPL for i in range(4)]) + np.array(_HuL(B, s))
-    _sys = manifold({'g': _HgT, 'u': _HuT}, P)
-    
-    Px[0:4, 4:8] = _sys['dips']['x']
-    Px[4:8, 0:4] = _sys['dips']['x'].conjugate().transpose()
+    # built in place into the scratch buffers, which LAPACK then overwrites as workspace
+    _HgT, _HuT = _scratch_buffers(_DTYPE_C)
+    _HgL(B, _strain, out=_HgT)
+    _HuL(B, _strain, out=_HuT)
+    _HuT.flat[::5] += ZPL
+    _sys = manifold({'g': _HgT, 'u': _HuT}, D, overwrite=True)
 
-    Py[0:4, 4:8] = _sys['dips']['y']
-    Py[4:8, 0:4] = _sys['dips']['y'].conjugate().transpose()
+    # x, y, z dipole operators in one contiguous (3, 8, 8) buffer
+    P = _embed_dipoles(np.stack([_sys.dips_x, _sys.dips_y, _sys.dips_z], axis=0))
 
-    Pz[0:4, 4:8] = _sys['dips']['z']
-    Pz[4:8, 0:4] = _sys['dips']['z'].conjugate().transpose()
+    # shared through the cache -- guard against in-place edits by callers
+    for _m in (P, *_sys):
+        _m.flags.writeable = False
+    return System(_sys, P)
 
-    return {'sys': _sys, 'px' : Px, 'py' : Py, 'pz' : Pz}
+system.cache_clear = _system_cached.cache_clear
 
 def system_small(_b, _s): 
 
-    P = dipole_matel()
+    D = dipole_matel(_DTYPE_C)
+    B = make_B_vector(_b,[0, 0, 1])
 
-    Px = np.zeros((4, 4), dtype=complex)
-    Py = np.zeros((4, 4), dtype=complex)
-    Pz = np.zeros((4, 4), dtype=complex)
+    _HgT = _HgL(B, s)
+    _HuT = _HuL(B, s)
+    _HuT.flat[::5] += ZPL
 
-    B = make_B_vector(_b,[0, 0, 1])
+    _sys = manifold_small({'g': _HgT, 'u': _HuT}, D)
 
-    _HgT = np.array(_HgL(B, s))
-    _HuT = np.diag([ZPL for i in range(4)]) + np.array(_HuL(B, s))
+    P = _embed_dipoles(np.stack([_sys.dips_x, _sys.dips_y, _sys.dips_z], axis=0))
 
-    _sys = manifold_small({'g': _HgT, 'u': _HuT}, P)
+    return System(_sys, P)
 
-    Px[0:2, 2:4] = _sys['dips']['x']
-    Px[2:4, 0:2] = _sys['dips']['x'].conjugate().transpose()
 
-    Py[0:2, 2:4] = _sys['dips']['y']
-    Py[2:4, 0:2] = _sys['dips']['y'].conjugate().transpose()
+def _hamiltonian_batch(bs, _s, b_vec):
+    """(N, 4, 4) ground and excited state Hamiltonians for the field magnitudes bs"""
+    B = make_B_vector_batch(bs, b_vec)
+    _HgT = _build_h_batch_jit(_Hg_static(_s).astype(_DTYPE_C, copy=False), B, gamma_L * f_g, gamma_S,
+                              np.empty((len(bs), 4, 4), dtype=_DTYPE_C))
+    _HuT = _build_h_batch_jit(_Hu_static(_s).astype(_DTYPE_C, copy=False), B, gamma_L * f_u, gamma_S,
+                              np.empty((len(bs), 4, 4), dtype=_DTYPE_C))
+    _HuT.reshape(len(bs), 16)[:, ::5] += ZPL
+    return _HgT, _HuT
 
-    Pz[0:2, 2:4] = _sys['dips']['z']
-    Pz[2:4, 0:2] = _sys['dips']['z'].conjugate().transpose()
+def system_batch(bs, b_vec=(0, 0, 1)):
+    """
+        system() over an array of field magnitudes bs, along a common b_vec (3,) or one
+        direction per point (N, 3). All Hamiltonians are diagonalised in one batched eigh call;
+        yields the per-point System tuples lazily. As for energy_sweep and energy_map, the
+        strain flag is the module-level s.
+    """
+    _Wg, _Wu, _Vg, _Vu, _ps = _manifold_batch(bs, s, b_vec)
+    for _n in range(len(_Wg)):
+        _sys = Manifold(_Wg[_n], _Wu[_n], _Vg[_n], _Vu[_n], _ps[_n, 0], _ps[_n, 1], _ps[_n, 2])
+        yield System(_sys, _embed_dipoles(_ps[_n]))
+
+def _manifold_batch(bs, _s, b_vec):
+    """batched eigensolve; returns the stacked Manifold fields with the dipoles as one (N, 3, 4, 4) array"""
+    bs = np.asarray(bs, dtype=float)
+    _HgT, _HuT = _hamiltonian_batch(bs, _s, b_vec)
+
+    _Wg, _Vg = np.linalg.eigh(_HgT)
+    _Wu, _Vu = np.linalg.eigh(_HuT)
+    # same phase convention as get_eigs, so the sweeps reproduce the per-point results
+    _fix_phase_batch(_Vg)
+    _fix_phase_batch(_Vu)
+    # (N, 3, 4, 4) dipole projections for all points and axes at once
+    _ps = _Vg.conjugate().transpose(0, 2, 1)[:, None] @ _DIP_STACK.astype(_DTYPE_C, copy=False)[None] @ _Vu[:, None]
+    return _Wg, _Wu, _Vg, _Vu, _ps
+
+def polarize(P, polarization):
+    """contracts a (..., 3, n, n) stack of dipole operators with a polarization 3-vector"""
+    _n = P.shape[-1]
+    _lead = P.shape[:-3]
+    return (np.asarray(polarization, dtype=P.dtype) @ P.reshape(_lead + (3, _n * _n))).reshape(_lead + (_n, _n))
+
+def _vacancy_dipole_ham(dip_mat):
+    """(..., n, n) -> (..., 2n, 2n) on the (n, l) product basis"""
+    _n = dip_mat.shape[-1]
+    # the l-bit of the (n, l) product basis passes through unchanged -> block diagonal in l
+    dip_ham = np.zeros(dip_mat.shape[:-2] + (2 * _n, 2 * _n), dtype=_DTYPE_C)
+    dip_ham[..., 0:_n, 0:_n] = dip_mat
+    dip_ham[..., _n:2 * _n, _n:2 * _n] = dip_mat
+    return dip_ham
 
-    return {'sys': _sys, 'px' : Px, 'py' : Py, 'pz' : Pz}
+def _bfield_directions(phis):
+    """b_vec = [cos(phi), 0, sin(phi)] for an array of angles, (N, 3)"""
+    phis = np.asarray(phis, dtype=float)
+    return np.stack([np.cos(phis), np.zeros_like(phis), np.sin(phis)], axis=1)
 
 
 def vacancy(**kwargs):
@@ -283,113 +640,76 @@ def vacancy(**kwargs):
     b_vec  = kwargs.get('b_vec', [0, 0, 1])
 
     _system = system(epsilon, False, b_vec = b_vec)
-    dip_mat = _system['px']
-    dim = len(dip_mat)
-    H = np.zeros((8, 8), dtype='float')
-    for i, k in enumerate(np.concatenate((_system['sys']['eigs']['g'], _system['sys']['eigs']['u']))): H[i, i] = k
-
-    base = [[[[0 if i != n else 1 for i in range(dim)], 0 if l == 0 else 1] for n in range(dim)] for l in range(2)]
-    base = [item for sublist in base for item in sublist]
-    snv_base = [[0 if i != n else 1 for i in range(dim)] for n in range(dim)]
-    hdim = len(base)
-    vacancy_ham = np.zeros((hdim, hdim), dtype=float)
-
-    for k, b in enumerate(base):
-        index = k
-        internal_index = snv_base.index(b[0])
-        vacancy_ham[index, k] = vacancy_ham[index, k] + H[internal_index, internal_index]
+    _levels = np.concatenate((_system.sys.eigs_g, _system.sys.eigs_u))
+
+    # the (n, l) product basis is ordered k = l * dim + n, so the internal level is just k % dim
+    vacancy_ham = np.diag(np.tile(_levels, 2))
     return vacancy_ham
 
 def vacancy4lvl():
     epsilon = 10 ** (-6)
     _system = system(epsilon, False)
-    dip_mat = _system['px']
-    dim = len(dip_mat)
-    H = np.zeros((4, 4), dtype='float')
-    for i, k in enumerate(np.concatenate((_system['sys']['eigs']['g'][::2], _system['sys']['eigs']['u'][::2]))): H[i, i] = k
-    return H
+    return np.diag(np.concatenate((_system.sys.eigs_g[::2], _system.sys.eigs_u[::2])))
 
 def vacancy_all_lvl(**kwargs):
     b_vec = kwargs.get('b_vec', [0, 0, 1])
     epsilon = kwargs.get('epsilon', 10 ** (-6))
     _system = system(epsilon, False, b_vec = b_vec)
-    dip_mat = _system['px']
-    dim = len(dip_mat)
-    H = np.zeros((dim, dim), dtype='float')
-    for i, k in enumerate(np.concatenate((_system['sys']['eigs']['g'], _system['sys']['eigs']['u']))): H[i, i] = k
-    return H
+    return np.diag(np.concatenate((_system.sys.eigs_g, _system.sys.eigs_u)))
 
 def dipole_ham(polarization, **kwargs):
     b_vec = kwargs.get('b_vec', [0,0,1])
     epsilon = kwargs.get('epsilon', 10 ** (-6))
     _system = system(epsilon, False, b_vec = b_vec)
-    dip_mat  = _system['px'] * polarization[0] + _system['py'] * polarization[1] + _system['pz'] * polarization[2]
-    dim = len(dip_mat)
-
-    base = [[[[0 if i != n else 1 for i in range(dim)], 0 if l == 0 else 1] for n in range(dim)] for l in range(2)]
-    base = [item for sublist in base for item in sublist]
-    hdim = len(base)
-
-    dip_ham = np.zeros((hdim, hdim), dtype=complex)
-    for k, b in enumerate(base):
-        state, fac = b, 1
-        if fac > 0:
-            for l in range(dim):
-                for m in range(dim):
-                    if state[0][m] == 1:
-                        out_state = [[0 if n != l else 1 for n in range(dim)], state[1]]
-                        index = base.index(out_state)
-                        internal_index = l
-                        dip_ham[index, k] = dip_ham[index, k] + dip_mat[internal_index, m]
-
-    return dip_ham
+    return _vacancy_dipole_ham(polarize(_system.P, polarization))
 
 def dipole_ham_bfield(polarization, phi, bm, **kwargs):
-    b_vec = np.array([np.cos(phi), 0, np.sin(phi)])
-    epsilon = bm
-    _system = system(epsilon, False, b_vec = b_vec)
-    dip_mat  = _system['px'] * polarization[0] + _system['py'] * polarization[1] + _system['pz'] * polarization[2]
-    dim = len(dip_mat)
-
-    base = [[[[0 if i != n else 1 for i in range(dim)], 0 if l == 0 else 1] for n in range(dim)] for l in range(2)]
-    base = [item for sublist in base for item in sublist]
-    hdim = len(base)
-
-    dip_ham = np.zeros((hdim, hdim), dtype=complex)
-
-    for k, b in enumerate(base):
-        state, fac = b, 1
-        if fac > 0:
-            for l in range(dim):
-                for m in range(dim):
-                    if state[0][m] == 1:
-                        out_state = [[0 if n != l else 1 for n in range(dim)], state[1]]
-                        index = base.index(out_state)
-                        internal_index = l
-                        dip_ham[index, k] = dip_ham[index, k] + dip_mat[internal_index, m]
+    return dipole_ham(polarization, epsilon=bm, b_vec=[np.cos(phi), 0, np.sin(phi)])
 
-    return dip_ham
+def dipole_ham_bfield_sweep(polarization, phis, bm):
+    """dipole_ham_bfield over an array of angles in one batched eigensolve, returns (N, 16, 16)"""
+    return _vacancy_dipole_ham(dipole_mat_bfield_sweep(polarization, phis, bm))
 
 def energy(**kwargs):
     epsilon = kwargs.get('epsilon' , 10 ** (-6))
     b_vec = kwargs.get('b_vec', [0,0,1])
     _system = system(epsilon, False, b_vec = b_vec)
-    ens = [i for i in np.concatenate((_system['sys']['eigs']['g'], _system['sys']['eigs']['u']))]
-    return ens
+    return np.concatenate((_system.sys.eigs_g, _system.sys.eigs_u))
+
+def energy_sweep(bs, b_vec=(0, 0, 1)):
+    """energy() over an array of field magnitudes, returns (N, 8): ground then excited levels"""
+    bs = np.asarray(bs, dtype=float)
+    _HgT, _HuT = _hamiltonian_batch(bs, s, b_vec)
+    # eigenvalues only, already ascending
+    return np.concatenate((np.linalg.eigvalsh(_HgT), np.linalg.eigvalsh(_HuT)), axis=1)
+
+def energy_map(bs, phis):
+    """
+        energy() on a (field magnitude, angle) grid with b_vec = [cos(phi), 0, sin(phi)] as in
+        dipole_mat_bfield. Rows are computed in parallel, returns (len(bs), len(phis), 8).
+        Always double precision, independent of set_precision.
+    """
+    bs = np.asarray(bs, dtype=float)
+    phis = np.asarray(phis, dtype=float)
+    return _energy_map_jit(bs, np.cos(phis), np.sin(phis), gamma_S, ZPL,
+                           _Hg_static(s), gamma_L * f_g, _Hu_static(s), gamma_L * f_u,
+                           np.empty((len(bs), len(phis), 8)))
 
 def dipole_mat(polarization, **kwargs):
     b_vec = kwargs.get('b_vec', [0,0,1])
     epsilon = kwargs.get('epsilon' , 10 ** (-6))
     _system = system(epsilon, False, b_vec = b_vec)
-    dip_mat = _system['px'] * polarization[0] + _system['py'] * polarization[1] + _system['pz'] * polarization[2]
+    dip_mat = polarize(_system.P, polarization)
     return dip_mat
 
 def dipole_mat_bfield(polarization, phi, bm, **kwargs):
-    b_vec = np.array([np.cos(phi), 0, np.sin(phi)])
-    epsilon = bm
-    _system = system(epsilon, False, b_vec=b_vec)
-    dip_mat = _system['px'] * polarization[0] + _system['py'] * polarization[1] + _system['pz'] * polarization[2]
-    return dip_mat
+    return dipole_mat(polarization, epsilon=bm, b_vec=[np.cos(phi), 0, np.sin(phi)])
+
+def dipole_mat_bfield_sweep(polarization, phis, bm):
+    """dipole_mat_bfield over an array of angles in one batched eigensolve, returns (N, 8, 8)"""
+    _b_vecs = _bfield_directions(phis)
+    _ps = _manifold_batch(np.full(len(_b_vecs), bm, dtype=float), s, _b_vecs)[-1]
+    return polarize(_embed_dipoles(_ps), polarization)
 
 def main():
     return
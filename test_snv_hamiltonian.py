@@ -0,0 +1,301 @@
+import numpy as np
+import pytest
+
+import snv_hamiltonian as snv
+
+# reference levels of the original implementation, THz rad: ground then excited manifold
+ENERGY_REF = [
+    (1e-6, [0, 0, 1], [-2.592765951119, -2.592765573302, 2.592765599355, 2.592765925066,
+                       3033.929180150136, 3033.929180523249, 3052.215435444534, 3052.215435774949]),
+    (0.5, [1, 0, 0], [-2.608064294735, -2.580375257404, 2.580375257404, 2.608064294735,
+                      3033.877234487035, 3033.980572342526, 3052.164043603907, 3052.267381459399]),
+    (3.0, [0, 0, 1], [-3.159498567169, -2.026047947281, 2.104206562143, 3.081339952308,
+                      3033.369482763943, 3034.488818777781, 3051.719841177464, 3052.711089173679]),
+]
+
+# |<g|p|u>| of the original implementation at epsilon = 0.5, b_vec = [1, 0, 0]
+DIPOLE_REF = {
+    'x': np.array([[0.401935030077, 0., 0., 0.915668188591],
+                   [0., 0.363817746521, 0.931470153744, 0.],
+                   [0., 0.931470153744, 0.363817746521, 0.],
+                   [0.915668188591, 0., 0., 0.401935030077]]),
+    'z': np.array([[1.950852731679, 0., 0., 0.440651357995],
+                   [0., 1.938885096267, 0.490636916136, 0.],
+                   [0., 0.490636916136, 1.938885096267, 0.],
+                   [0.440651357995, 0., 0., 1.950852731679]]),
+}
+
+
+def _one_hot_base(dim):
+    # (n, l) product basis as built by the original list implementation
+    base = [[[[0 if i != n else 1 for i in range(dim)], 0 if l == 0 else 1] for n in range(dim)] for l in range(2)]
+    return [item for sublist in base for item in sublist]
+
+def _vacancy_loop(levels):
+    dim = len(levels)
+    H = np.diag(levels)
+    base = _one_hot_base(dim)
+    snv_base = [[0 if i != n else 1 for i in range(dim)] for n in range(dim)]
+    vacancy_ham = np.zeros((len(base), len(base)))
+    for k, b in enumerate(base):
+        internal_index = snv_base.index(b[0])
+        vacancy_ham[k, k] += H[internal_index, internal_index]
+    return vacancy_ham
+
+def _dipole_ham_loop(dip_mat):
+    dim = len(dip_mat)
+    base = _one_hot_base(dim)
+    dip_ham = np.zeros((len(base), len(base)), dtype=complex)
+    for k, state in enumerate(base):
+        for l in range(dim):
+            for m in range(dim):
+                if state[0][m] == 1:
+                    index = base.index([[0 if n != l else 1 for n in range(dim)], state[1]])
+                    dip_ham[index, k] += dip_mat[l, m]
+    return dip_ham
+
+def _random_hermitian(n, rng):
+    _a = rng.normal(size=(n, n)) + 1j * rng.normal(size=(n, n))
+    return _a + _a.conj().T
+
+
+@pytest.mark.parametrize('epsilon, b_vec, ref', ENERGY_REF)
+def test_energy_reference(epsilon, b_vec, ref):
+    assert np.allclose(snv.energy(epsilon=epsilon, b_vec=b_vec), ref, rtol=0, atol=1e-8)
+
+@pytest.mark.parametrize('epsilon, b_vec', [(1e-6, [0, 0, 1]), (0.5, [1, 0, 0]), (2., [0.3, 0.2, 0.9])])
+def test_vacancy_matches_loop(epsilon, b_vec):
+    levels = snv.energy(epsilon=epsilon, b_vec=b_vec)
+    assert len(levels) == 8
+    assert np.array_equal(snv.vacancy(epsilon=epsilon, b_vec=b_vec), _vacancy_loop(levels))
+
+@pytest.mark.parametrize('polarization', [[1, 0, 0], [0, 1, 0], [0, 0, 1], [0.5, 0.3j, 0.2]])
+def test_dipole_ham_matches_loop(polarization):
+    dip_mat = snv.dipole_mat(polarization, epsilon=0.5, b_vec=[1, 0, 0])
+    assert np.allclose(snv.dipole_ham(polarization, epsilon=0.5, b_vec=[1, 0, 0]), _dipole_ham_loop(dip_mat))
+
+@pytest.mark.parametrize('axis, polarization', [('x', [1, 0, 0]), ('z', [0, 0, 1])])
+def test_dipole_ham_reference(axis, polarization):
+    dip_ham = np.abs(snv.dipole_ham(polarization, epsilon=0.5, b_vec=[1, 0, 0]))
+    blk = np.zeros((8, 8))
+    blk[0:4, 4:8] = DIPOLE_REF[axis]
+    blk[4:8, 0:4] = DIPOLE_REF[axis].T
+    assert np.allclose(dip_ham, np.kron(np.eye(2), blk), atol=1e-8)
+
+
+def test_get_eigs_array_like():
+    H = snv.snv_hamiltonian(0.5, False, b_vec=[1, 0, 0])[4:8, 4:8]
+    w, v = snv.get_eigs(H.tolist())
+    w_ref, v_ref = snv.get_eigs(H.copy())
+    assert np.array_equal(w, w_ref)
+    assert np.array_equal(v, v_ref)
+
+def test_get_eigs_phase_convention():
+    H = snv.snv_hamiltonian(0.5, False, b_vec=[1, 0, 0])[4:8, 4:8].copy()
+    w, v = snv.get_eigs(H)
+    assert np.allclose(w, np.linalg.eigvalsh(H))
+    assert np.allclose(H @ v, v * w)
+    # first largest component of each eigenvector is real and positive
+    _lead = v[np.argmax(np.abs(v) >= np.abs(v).max(axis=0) * (1. - 1e-6), axis=0), np.arange(4)]
+    assert np.allclose(_lead.imag, 0.)
+    assert np.all(_lead.real > 0.)
+
+def test_eigh2_random():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        H = _random_hermitian(2, rng)
+        w, v = snv._eigh2(H)
+        assert np.allclose(w, np.linalg.eigvalsh(H))
+        assert np.allclose(H @ v, v * w)
+        assert np.allclose(v.conj().T @ v, np.eye(2))
+
+@pytest.mark.parametrize('H', [np.diag([2., -1.]).astype(complex), np.eye(2, dtype=complex)])
+def test_eigh2_diagonal(H):
+    w, v = snv._eigh2(H)
+    assert np.allclose(w, np.sort(H.diagonal().real))
+    assert np.allclose(H @ v, v * w)
+    assert np.allclose(v.conj().T @ v, np.eye(2))
+
+@pytest.mark.parametrize('b', [0., 1e-6, 0.5, 3.])
+def test_get_eigs_blocks(b):
+    H = snv.snv_hamiltonian(b, False)[4:8, 4:8].copy()
+    w, v = snv.get_eigs_blocks(H)
+    assert np.allclose(w, np.linalg.eigvalsh(H))
+    assert np.allclose(H @ v, v * w)
+    assert np.allclose(v.conj().T @ v, np.eye(4))
+
+def test_get_eigs_blocks_coupled():
+    H = snv.snv_hamiltonian(0.5, False, b_vec=[1, 0, 0])[4:8, 4:8].copy()
+    w, v = snv.get_eigs_blocks(H)
+    w_ref, v_ref = snv.get_eigs(H.copy())
+    assert np.allclose(w, w_ref)
+    assert np.allclose(v, v_ref)
+
+@pytest.mark.parametrize('H', [np.eye(2, dtype=complex), _random_hermitian(6, np.random.default_rng(1))])
+def test_get_eigs_blocks_other_shapes(H):
+    w, v = snv.get_eigs_blocks(H)
+    assert np.allclose(w, np.linalg.eigvalsh(H))
+    assert np.allclose(H @ v, v * w)
+
+def test_get_eigs_blocks_real_input():
+    H = snv.snv_hamiltonian(0.5, False)[4:8, 4:8].real.copy()
+    w, v = snv.get_eigs_blocks(H)
+    assert w.dtype == np.float64 and v.dtype == np.complex128
+    assert np.allclose(H @ v, v * w)
+
+
+@pytest.mark.parametrize('strain', [False, True])
+def test_system_batch(monkeypatch, strain):
+    monkeypatch.setattr(snv, 's', strain)
+    bs = [0.5, 2.]
+    for b, batch in zip(bs, snv.system_batch(bs, b_vec=[0.3, 0.2, 0.9])):
+        ref = snv.system(b, False, b_vec=[0.3, 0.2, 0.9])
+        for a, r in zip(batch.sys, ref.sys):
+            assert np.allclose(a, r)
+        assert np.allclose(batch.P, ref.P)
+
+
+@pytest.fixture
+def fresh_cache():
+    snv.system.cache_clear()
+    yield
+    snv.system.cache_clear()
+
+def test_energy_0d_epsilon():
+    assert np.array_equal(snv.energy(epsilon=np.array(0.5)), snv.energy(epsilon=0.5))
+
+@pytest.mark.parametrize('scale', [1e-13, 1e-12, 10.])
+def test_energy_b_vec_scale(fresh_cache, scale):
+    for b_vec in ([1, 0, 0], [1.4, 0, 1], [0.3, 0.2, 0.9]):
+        ref = snv.energy(epsilon=1., b_vec=b_vec)
+        assert np.allclose(snv.energy(epsilon=1., b_vec=scale * np.array(b_vec)), ref, rtol=0, atol=1e-10)
+
+def test_cache_clear_after_parameter_change(fresh_cache, monkeypatch):
+    ref = snv.energy(epsilon=1., b_vec=[1, 0, 0])
+    monkeypatch.setattr(snv, 'gamma_S', 1.1 * snv.gamma_S)
+    assert np.array_equal(snv.energy(epsilon=1., b_vec=[1, 0, 0]), ref)
+    snv.system.cache_clear()
+    changed = snv.energy(epsilon=1., b_vec=[1, 0, 0])
+    assert not np.allclose(changed, ref)
+    assert np.allclose(changed, snv.energy_sweep([1.], [1, 0, 0])[0])
+
+def test_system_read_only():
+    _system = snv.system(0.5, False, b_vec=[1, 0, 0])
+    for _m in (_system.P, *_system.sys):
+        with pytest.raises(ValueError):
+            _m[0] = 0
+    assert snv.system(0.5, False, b_vec=[1, 0, 0]) is _system
+
+
+@pytest.mark.parametrize('make', [lambda: snv.make_B_vector(1., [0, 0, 0]),
+                                  lambda: snv.make_B_vector_batch([1., 2.], [0, 0, 0]),
+                                  lambda: snv.make_B_vector_batch([1., 2.], [[0, 0, 1], [0, 0, 0]])])
+def test_zero_direction(make):
+    with pytest.raises(ValueError):
+        make()
+
+def test_make_B_vector_batch():
+    v = [0.1, -0.4, 2]
+    assert np.allclose(snv.make_B_vector(2., v), 2. * np.array(v) / np.linalg.norm(v))
+    assert np.allclose(snv.make_B_vector_batch([2., 3.], v), [snv.make_B_vector(2., v), snv.make_B_vector(3., v)])
+    assert np.allclose(snv.make_B_vector_batch([2., 3.], [v, v[::-1]]),
+                       [snv.make_B_vector(2., v), snv.make_B_vector(3., v[::-1])])
+
+
+def test_energy_sweep():
+    bs = [0.5, 1., 3.]
+    for b_vec in ([0, 0, 1], [0.3, 0.2, 0.9]):
+        sweep = snv.energy_sweep(bs, b_vec)
+        assert np.allclose(sweep, [snv.energy(epsilon=b, b_vec=b_vec) for b in bs])
+
+def test_energy_map():
+    bs, phis = [0.5, 2.], [0., 0.4, 1.3]
+    emap = snv.energy_map(bs, phis)
+    assert emap.shape == (2, 3, 8)
+    for i, b in enumerate(bs):
+        for j, phi in enumerate(phis):
+            assert np.allclose(emap[i, j], snv.energy(epsilon=b, b_vec=[np.cos(phi), 0, np.sin(phi)]))
+
+
+@pytest.fixture
+def single_precision():
+    snv.set_precision('single')
+    yield
+    snv.set_precision('double')
+
+def test_single_precision(single_precision):
+    _system = snv.system(0.5, False, b_vec=[1, 0, 0])
+    assert _system.sys.eigs_g.dtype == np.float32
+    assert _system.P.dtype == np.complex64
+    assert np.allclose(_system.sys.eigs_u, ENERGY_REF[1][2][4:], rtol=1e-6)
+    # excited levels sit on the ZPL, float32 only resolves them to ~1e-3 relative mixing
+    assert np.allclose(np.abs(_system.P[0, 0:4, 4:8]), DIPOLE_REF['x'], atol=5e-3)
+
+    _small = snv.system_small(3., False)
+    assert _small.sys.eigs_g.dtype == np.float32
+    assert _small.sys.vecs_g.dtype == np.complex64
+    assert np.allclose(_small.sys.eigs_g, ENERGY_REF[2][2][:4:2], atol=1e-4)
+
+    assert snv.energy_sweep([0.5], [1, 0, 0]).dtype == np.float32
+    assert snv.energy_map([0.5], [0.]).dtype == np.float64
+
+def test_set_precision_invalid():
+    with pytest.raises(ValueError, match="'single' or 'double'"):
+        snv.set_precision('half')
+    assert snv.energy().dtype == np.float64
+
+
+def test_dict_style_access():
+    _system = snv.system(0.5, False, b_vec=[1, 0, 0])
+    _sys = _system['sys']
+    assert _sys is _system.sys
+    for _k, _v in (('g', _sys.eigs_g), ('u', _sys.eigs_u)):
+        assert _sys['eigs'][_k] is _v
+    for _k, _v in (('g', _sys.vecs_g), ('u', _sys.vecs_u)):
+        assert _sys['vecs'][_k] is _v
+    for _i, _k in enumerate('xyz'):
+        assert _sys['dips'][_k] is _sys[4 + _i]
+        assert np.array_equal(_system['p' + _k], _system.P[_i])
+    assert _system['p'] is _system.P
+    assert _system[0] is _sys
+    assert _sys[0] is _sys.eigs_g
+
+
+@pytest.mark.parametrize('polarization', [[1, 0, 0], [0, 0, 1]])
+def test_bfield_sweeps(polarization):
+    phis = [0., 0.4, 1.3]
+    mats = snv.dipole_mat_bfield_sweep(polarization, phis, 2.)
+    hams = snv.dipole_ham_bfield_sweep(polarization, phis, 2.)
+    for phi, m, h in zip(phis, mats, hams):
+        assert np.allclose(m, snv.dipole_mat_bfield(polarization, phi, 2.))
+        assert np.allclose(h, snv.dipole_ham_bfield(polarization, phi, 2.))
+
+
+def _hamiltonian_terms(b, b_vec, strain):
+    # the public model terms summed up directly, ground then excited manifold
+    B = snv.make_B_vector(b, b_vec)
+    _Hg = snv._Hg0 + snv.H_ZL(B, snv.gamma_L, snv.f_g) + snv.H_ZS(B, snv.gamma_S)
+    _Hu = snv._Hu0 + snv.H_ZL(B, snv.gamma_L, snv.f_u) + snv.H_ZS(B, snv.gamma_S) + snv.ZPL * np.eye(4)
+    if strain:
+        _Hg = _Hg + snv.H_st(snv.alpha_g, snv.beta_g, snv.delta_g)
+        _Hu = _Hu + snv.H_st(snv.alpha_u, snv.beta_u, snv.delta_u)
+    return _Hg, _Hu
+
+@pytest.mark.parametrize('strain', [False, True])
+def test_strain_specialisation(fresh_cache, monkeypatch, strain):
+    monkeypatch.setattr(snv, 's', strain)
+    b_vec = [0.3, 0.2, 0.9]
+    _Hg, _Hu = _hamiltonian_terms(0.5, b_vec, strain)
+    assert np.allclose(snv._HgL(snv.make_B_vector(0.5, b_vec), strain), _Hg)
+    ref = np.concatenate((np.linalg.eigvalsh(_Hg), np.linalg.eigvalsh(_Hu)))
+    assert np.allclose(snv.energy(epsilon=0.5, b_vec=b_vec), ref)
+    assert np.allclose(snv.energy_sweep([0.5], b_vec)[0], ref)
+
+def test_strain_parameters_read_at_call_time(fresh_cache, monkeypatch):
+    monkeypatch.setattr(snv, 's', True)
+    monkeypatch.setattr(snv, 'alpha_g', 2. * snv.alpha_g)
+    monkeypatch.setattr(snv, 'beta_u', 0.5 * snv.beta_u)
+    _Hg, _Hu = _hamiltonian_terms(0.5, [1, 0, 0], True)
+    ref = np.concatenate((np.linalg.eigvalsh(_Hg), np.linalg.eigvalsh(_Hu)))
+    assert np.allclose(snv.energy(epsilon=0.5, b_vec=[1, 0, 0]), ref)
+    assert np.allclose(snv.energy_map([0.5], [0.])[0, 0], ref)